@@ -1,15 +1,34 @@
+import asyncio
+import hashlib
+import html
 import logging
 import os
-import shutil
+import re
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from io import BytesIO
 from typing import Annotated, Optional
 
-import requests
-from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+import httpx
+from cachetools import TTLCache
+from fastapi import (
+    Depends,
+    FastAPI,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Request,
+    UploadFile,
+)
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
 from google import genai
 from PIL import Image
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
 
 # Register HEIC support globally (needed for PIL.Image.open to work with HEIC)
 try:
@@ -20,10 +39,24 @@ except ImportError:
     pass  # HEIC support not available
 
 from src.config import Settings, get_settings
-from src.engine import FashionEngine
+from src.engine import FashionEngine, preprocess_image
 
 logger = logging.getLogger(__name__)
 
+# Filename metadata parsing (compiled once, used on every /generate request)
+# Words to ignore (these are not garment types)
+_IGNORE_WORDS = frozenset({"front", "back", "frente", "costas"})
+# Pattern: starts with digits, optionally followed by underscore, then text (type),
+# then underscore or end. A single match yields the number and, if present, the type.
+# This handles: 47_pantalon_..., 100_vestidofesta_..., 12_20251229..., etc.
+# Type letters: ASCII plus Latin-1/Latin Extended-A letters (ç, ã, é, ô, É, ...)
+_METADATA_RE = re.compile(
+    r"^(\d+)(?:_([a-zA-Z\u00c0-\u00d6\u00d8-\u00f6\u00f8-\u017f]+)(?=_|$))?"
+)
+
+# Upload extensions accepted by the generate endpoints
+_ALLOWED_EXTENSIONS = frozenset({".png", ".jpg", ".jpeg", ".heic", ".heif"})
+
 
 # --- Schemas ---
 class HealthResponse(BaseModel):
@@ -34,16 +67,108 @@ class HealthResponse(BaseModel):
 
 
 # --- Initialization ---
-app = FastAPI(title="Cabide AI API - Brazil/France Hybrid")
+def _new_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(http2=True, timeout=5.0)
+
+
+def _new_preprocess_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="preprocess"
+    )
+
+
+# Shared async HTTP client for OAuth verification (keeps connections to Google warm)
+_http = _new_http_client()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _http
+    # Closed by a previous shutdown in this process (e.g. repeated test clients)
+    if _http.is_closed:
+        _http = _new_http_client()
+    # Load every Pillow plugin now; otherwise the first HEIC/WebP upload pays for it
+    Image.init()
+    # Dedicated worker threads for CPU-bound image preprocessing (also bounds
+    # concurrency); released with the app instead of living for the whole process
+    app.state.preprocess_pool = _new_preprocess_pool()
+    yield
+    app.state.preprocess_pool.shutdown(wait=False)
+    await _http.aclose()
+
+
+app = FastAPI(title="Cabide AI API - Brazil/France Hybrid", lifespan=lifespan)
+
+
+class _RequestSizeLimitMiddleware:
+    """
+    Reject /generate bodies above max_bytes with 413 before Starlette spools
+    them to disk. A declared Content-Length is checked up front; chunked
+    bodies are counted as they arrive and cut off once they cross the limit.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/generate"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.max_bytes
+        detail = f"Request too large. Maximum size is {limit // (1024 * 1024)} MB."
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised while the form is parsed; FastAPI re-raises HTTPException
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
 
-# Prepare directories for local mode
 _init_settings = get_settings()
+
+app.add_middleware(
+    _RequestSizeLimitMiddleware, max_bytes=_init_settings.max_request_bytes
+)
+
+# Prepare directories for local mode
 os.makedirs(_init_settings.temp_upload_dir, exist_ok=True)
 os.makedirs(_init_settings.output_dir, exist_ok=True)
 
 # Initialize Engine (Engine logic now handles GCS vs Local internally)
 engine = FashionEngine()
 
+# Verified OAuth user info, keyed by a 16-byte BLAKE2b digest of the token
+# (raw tokens are never stored)
+_oauth_cache: Optional[TTLCache] = (
+    TTLCache(maxsize=10_000, ttl=_init_settings.oauth_cache_ttl)
+    if _init_settings.oauth_cache_ttl > 0
+    else None
+)
+_oauth_cache_lock = asyncio.Lock()
+
+# Caps concurrent Gemini generations per worker to avoid provider-side throttling
+_generation_semaphore = asyncio.Semaphore(_init_settings.max_concurrent_generations)
+
+# Last Gemini connectivity probe as (monotonic timestamp, ok), reused by /health
+_GEMINI_HEALTH_TTL = 30.0  # seconds
+_gemini_health: tuple[float, bool] = (float("-inf"), False)
+
 # --- Helper Functions ---
 
 
@@ -51,6 +176,9 @@ async def verify_oauth_token(authorization: Optional[str] = Header(None)):
     """
     Verify OAuth token by calling Google's userinfo endpoint.
 
+    Successful verifications are cached for OAUTH_CACHE_TTL seconds so repeat
+    requests with the same token skip the Google roundtrip.
+
     Args:
         authorization: Authorization header with Bearer token
 
@@ -75,13 +203,19 @@ async def verify_oauth_token(authorization: Optional[str] = Header(None)):
         )
 
     token = parts[1]
+    cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    if _oauth_cache is not None:
+        async with _oauth_cache_lock:
+            cached_user_info = _oauth_cache.get(cache_key)
+        if cached_user_info is not None:
+            return cached_user_info
 
     # Verify token with Google
     try:
-        response = requests.get(
+        response = await _http.get(
             "https://www.googleapis.com/oauth2/v2/userinfo",
             headers={"Authorization": f"Bearer {token}"},
-            timeout=5,
         )
 
         if response.status_code != 200:
@@ -91,53 +225,37 @@ async def verify_oauth_token(authorization: Optional[str] = Header(None)):
 
         user_info = response.json()
         logger.info(f"Authenticated request from: {user_info.get('email', 'unknown')}")
+
+        if _oauth_cache is not None:
+            async with _oauth_cache_lock:
+                _oauth_cache[cache_key] = user_info
         return user_info
 
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"OAuth verification failed: {e}")
         raise HTTPException(status_code=401, detail="Failed to verify OAuth token")
 
 
-def _preprocess_image(image_path: str, settings: Settings) -> str:
+async def _preprocess_upload(
+    file: UploadFile, settings: Settings, pool: ThreadPoolExecutor
+) -> BytesIO:
     """
-    Preprocess image for Gemini 3 optimization:
-    - Resize to max_image_dimension (1536px for MEDIUM)
-    - Convert to JPEG with quality setting
-    - Save back to same path with .jpg extension
+    Run preprocess_image on an upload in the preprocessing thread pool.
 
-    Args:
-        image_path: Path to the image file
-        settings: Application settings with image processing config
+    Pillow releases the GIL while decoding, resizing and encoding, so the
+    files of a multi-file request are processed in parallel.
 
-    Returns:
-        Path to the processed JPEG file
+    Raises:
+        HTTPException: If the image cannot be processed
     """
-    img = Image.open(image_path)
-
-    # Convert RGBA to RGB if needed (JPEG doesn't support transparency)
-    if img.mode == "RGBA":
-        rgb_img = Image.new("RGB", img.size, (255, 255, 255))
-        rgb_img.paste(img, mask=img.split()[3])  # Use alpha channel as mask
-        img = rgb_img
-    elif img.mode != "RGB":
-        img = img.convert("RGB")
-
-    # Resize if needed (maintain aspect ratio)
-    max_dim = settings.max_image_dimension
-    if max(img.size) > max_dim:
-        ratio = max_dim / max(img.size)
-        new_size = tuple(int(dim * ratio) for dim in img.size)
-        img = img.resize(new_size, Image.Resampling.LANCZOS)
-
-    # Save as JPEG
-    jpg_path = os.path.splitext(image_path)[0] + ".jpg"
-    img.save(jpg_path, format="JPEG", quality=settings.image_quality, optimize=True)
-
-    # Remove original if different
-    if jpg_path != image_path and os.path.exists(image_path):
-        os.remove(image_path)
-
-    return jpg_path
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, preprocess_image, file.file, settings)
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Failed to process image {file.filename}: {str(e)}",
+        )
 
 
 def _extract_metadata_from_filename(filename: str) -> tuple[str | None, str | None]:
@@ -155,35 +273,46 @@ def _extract_metadata_from_filename(filename: str) -> tuple[str | None, str | No
     Returns:
         tuple: (garment_number, garment_type) or (None, None) if extraction fails
     """
-    import re
-
     # Remove file extension
     name_without_ext = os.path.splitext(filename)[0]
 
-    # Words to ignore (these are not garment types)
-    ignore_words = {"front", "back", "frente", "costas"}
+    # Fast path for plain ASCII names; anything else goes through the regex
+    parts = name_without_ext.split("_", 2)
+    if (
+        len(parts) >= 2
+        and parts[0].isascii()
+        and parts[0].isdigit()
+        and parts[1].isascii()
+        and parts[1].isalpha()
+    ):
+        garment_type = parts[1].lower()
+        if garment_type in _IGNORE_WORDS:
+            return (parts[0], None)
+        return (parts[0], garment_type)
 
-    # Pattern: starts with digits, followed by underscore, then text (type), then underscore or end
-    # This handles: 47_pantalon_..., 100_vestidofesta_..., etc.
-    pattern = r"^(\d+)_([a-zA-Zàéèêç]+)(?:_|$)"
-    match = re.match(pattern, name_without_ext)
+    match = _METADATA_RE.match(name_without_ext)
+    if not match:
+        return (None, None)
 
-    if match:
-        number = match.group(1)
-        garment_type = match.group(2).lower()
+    number, garment_type = match.groups()
+    garment_type = garment_type.lower() if garment_type else None
 
-        # Skip if it's a position indicator, not a garment type
-        if garment_type in ignore_words:
-            return (number, None)
+    # Skip if it's a position indicator, not a garment type
+    if garment_type in _IGNORE_WORDS:
+        return (number, None)
 
-        return (number, garment_type)
+    return (number, garment_type)
 
-    # Fallback: try to extract just the number if format is different
-    number_match = re.match(r"^(\d+)", name_without_ext)
-    if number_match:
-        return (number_match.group(1), None)
 
-    return (None, None)
+def _probe_gemini(client: genai.Client) -> bool:
+    """Return True if the Gemini API answers a minimal model listing."""
+    try:
+        # Quick test - fetch a single-model page (the pager never walks further)
+        client.models.list(config={"page_size": 1, "http_options": {"timeout": 2000}})
+        return True
+    except Exception as e:
+        logger.warning(f"Gemini health check failed: {e}")
+        return False
 
 
 # --- Endpoints ---
@@ -191,6 +320,7 @@ def _extract_metadata_from_filename(filename: str) -> tuple[str | None, str | No
 
 @app.post("/generate/test")
 async def generate_model_photo_test(
+    request: Request,
     files: Annotated[list[UploadFile], File(description="Garment photo(s)")],
     env: Annotated[str, Form()] = "street",
     garment_number: Annotated[str | None, Form()] = None,
@@ -242,11 +372,10 @@ async def generate_model_photo_test(
             detail="garment_number and garment_type are required. Either provide them explicitly or use a filename with format: <number>_<type>_<rest>.ext (e.g., 42_pantalon_20251229.HEIC)",
         )
 
-    job_id = str(uuid.uuid4())
-    temp_paths = []
+    job_id = uuid.uuid4().hex
 
     try:
-        # Process all uploaded files
+        # Validate all uploaded files
         for idx, file in enumerate(files):
             if not file.filename:
                 raise HTTPException(
@@ -254,57 +383,66 @@ async def generate_model_photo_test(
                 )
 
             file_ext = os.path.splitext(file.filename)[1].lower()
-            if file_ext not in [".png", ".jpg", ".jpeg", ".heic", ".heif"]:
+            if file_ext not in _ALLOWED_EXTENSIONS:
                 raise HTTPException(
                     status_code=400,
                     detail=f"Unsupported file type: {file_ext}. Use PNG, JPG, JPEG, HEIC, or HEIF.",
                 )
 
-            temp_path = os.path.join(
-                settings.temp_upload_dir, f"{job_id}_{idx}{file_ext}"
-            )
-
-            # Save upload to temp
-            with open(temp_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-
-            # Preprocess image: validate, convert to JPEG, resize to 1536px
-            # This handles HEIC, PNG, and all other formats uniformly
-            try:
-                processed_path = _preprocess_image(temp_path, settings)
-                temp_paths.append(processed_path)
-            except Exception as e:
+            # Second guard after parsing: the whole body already passed the
+            # request limit, this caps any single photo within it
+            if file.size is not None and file.size > settings.max_upload_bytes:
                 raise HTTPException(
-                    status_code=400,
-                    detail=f"Failed to process image {file.filename}: {str(e)}",
+                    status_code=413,
+                    detail=f"File {file.filename} is too large. Maximum size is {settings.max_upload_bytes // (1024 * 1024)} MB.",
                 )
 
-        # For conjunto, prepare metadata
+        # Preprocess images: validate, convert to JPEG, resize to 1536px
+        # This handles HEIC, PNG, and all other formats uniformly
+        # Wait for every file so no worker is still reading an upload after we return
+        results = await asyncio.gather(
+            *(
+                _preprocess_upload(file, settings, request.app.state.preprocess_pool)
+                for file in files
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        # For conjunto, prepare metadata (only when pieces were provided)
         conjunto_pieces = None
-        if garment_type == "Conjunto":
+        if garment_type.casefold() == "conjunto" and (
+            piece1_type or piece2_type or piece3_type
+        ):
             conjunto_pieces = {
                 "piece1_type": piece1_type,
                 "piece2_type": piece2_type,
                 "piece3_type": piece3_type,
             }
 
-        # Generate using Engine
-        # If single file, pass as string; if multiple, pass as list
-        input_paths = temp_paths[0] if len(temp_paths) == 1 else temp_paths
-
-        result_path_or_url = engine.generate_lifestyle_photo(
-            input_paths,
-            environment=env,
-            activity="posing for a lifestyle catalog",
-            garment_number=garment_number,
-            garment_type=garment_type,
-            position=position,
-            conjunto_pieces=conjunto_pieces,
-            feedback=feedback,
-        )
+        # Generate using Engine (always a list: one buffer per upload, in order)
+        # Run the blocking Gemini call in a thread so other requests keep flowing
+        async with _generation_semaphore:
+            result_path_or_url = await asyncio.to_thread(
+                engine.generate_lifestyle_photo,
+                results,
+                environment=env,
+                activity="posing for a lifestyle catalog",
+                garment_number=garment_number,
+                garment_type=garment_type,
+                position=position,
+                conjunto_pieces=conjunto_pieces,
+                feedback=feedback,
+                job_id=job_id,
+            )
 
         # Always return file (GCS disabled - using Drive for permanent storage)
-        if not os.path.exists(result_path_or_url):
+        # The stat doubles as the existence check and saves Starlette a second one
+        try:
+            result_stat = os.stat(result_path_or_url)
+        except FileNotFoundError:
             raise HTTPException(
                 status_code=500, detail="Generated image file not found"
             )
@@ -313,6 +451,14 @@ async def generate_model_photo_test(
             path=result_path_or_url,
             media_type="image/png",
             filename=f"cabide_{job_id}.png",
+            stat_result=result_stat,
+            headers={"Cache-Control": "no-store"},
+            # Per-job file: optionally drop it once sent
+            background=(
+                None
+                if settings.keep_generated_images
+                else BackgroundTask(os.remove, result_path_or_url)
+            ),
         )
 
     except HTTPException:
@@ -320,15 +466,11 @@ async def generate_model_photo_test(
     except Exception as e:
         logger.error(f"Generation failed for job {job_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Engine Error: {str(e)}")
-    finally:
-        # Clean up all temp files
-        for temp_path in temp_paths:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
 
 
 @app.post("/generate")
 async def generate_model_photo(
+    request: Request,
     files: Annotated[list[UploadFile], File(description="Garment photo(s)")],
     env: Annotated[str, Form()] = "street",
     garment_number: Annotated[str | None, Form()] = None,
@@ -380,11 +522,10 @@ async def generate_model_photo(
             detail="garment_number and garment_type are required. Either provide them explicitly or use a filename with format: <number>_<type>_<rest>.ext (e.g., 42_pantalon_20251229.HEIC)",
         )
 
-    job_id = str(uuid.uuid4())
-    temp_paths = []
+    job_id = uuid.uuid4().hex
 
     try:
-        # Process all uploaded files
+        # Validate all uploaded files
         for idx, file in enumerate(files):
             if not file.filename:
                 raise HTTPException(
@@ -392,57 +533,66 @@ async def generate_model_photo(
                 )
 
             file_ext = os.path.splitext(file.filename)[1].lower()
-            if file_ext not in [".png", ".jpg", ".jpeg", ".heic", ".heif"]:
+            if file_ext not in _ALLOWED_EXTENSIONS:
                 raise HTTPException(
                     status_code=400,
                     detail=f"Unsupported file type: {file_ext}. Use PNG, JPG, JPEG, HEIC, or HEIF.",
                 )
 
-            temp_path = os.path.join(
-                settings.temp_upload_dir, f"{job_id}_{idx}{file_ext}"
-            )
-
-            # Save upload to temp
-            with open(temp_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-
-            # Preprocess image: validate, convert to JPEG, resize to 1536px
-            # This handles HEIC, PNG, and all other formats uniformly
-            try:
-                processed_path = _preprocess_image(temp_path, settings)
-                temp_paths.append(processed_path)
-            except Exception as e:
+            # Second guard after parsing: the whole body already passed the
+            # request limit, this caps any single photo within it
+            if file.size is not None and file.size > settings.max_upload_bytes:
                 raise HTTPException(
-                    status_code=400,
-                    detail=f"Failed to process image {file.filename}: {str(e)}",
+                    status_code=413,
+                    detail=f"File {file.filename} is too large. Maximum size is {settings.max_upload_bytes // (1024 * 1024)} MB.",
                 )
 
-        # For conjunto, prepare metadata
+        # Preprocess images: validate, convert to JPEG, resize to 1536px
+        # This handles HEIC, PNG, and all other formats uniformly
+        # Wait for every file so no worker is still reading an upload after we return
+        results = await asyncio.gather(
+            *(
+                _preprocess_upload(file, settings, request.app.state.preprocess_pool)
+                for file in files
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        # For conjunto, prepare metadata (only when pieces were provided)
         conjunto_pieces = None
-        if garment_type == "Conjunto":
+        if garment_type.casefold() == "conjunto" and (
+            piece1_type or piece2_type or piece3_type
+        ):
             conjunto_pieces = {
                 "piece1_type": piece1_type,
                 "piece2_type": piece2_type,
                 "piece3_type": piece3_type,
             }
 
-        # Generate using Engine
-        # If single file, pass as string; if multiple, pass as list
-        input_paths = temp_paths[0] if len(temp_paths) == 1 else temp_paths
-
-        result_path_or_url = engine.generate_lifestyle_photo(
-            input_paths,
-            environment=env,
-            activity="posing for a lifestyle catalog",
-            garment_number=garment_number,
-            garment_type=garment_type,
-            position=position,
-            conjunto_pieces=conjunto_pieces,
-            feedback=feedback,
-        )
+        # Generate using Engine (always a list: one buffer per upload, in order)
+        # Run the blocking Gemini call in a thread so other requests keep flowing
+        async with _generation_semaphore:
+            result_path_or_url = await asyncio.to_thread(
+                engine.generate_lifestyle_photo,
+                results,
+                environment=env,
+                activity="posing for a lifestyle catalog",
+                garment_number=garment_number,
+                garment_type=garment_type,
+                position=position,
+                conjunto_pieces=conjunto_pieces,
+                feedback=feedback,
+                job_id=job_id,
+            )
 
         # Always return file (GCS disabled - using Drive for permanent storage)
-        if not os.path.exists(result_path_or_url):
+        # The stat doubles as the existence check and saves Starlette a second one
+        try:
+            result_stat = os.stat(result_path_or_url)
+        except FileNotFoundError:
             raise HTTPException(
                 status_code=500, detail="Generated image file not found"
             )
@@ -451,6 +601,14 @@ async def generate_model_photo(
             path=result_path_or_url,
             media_type="image/png",
             filename=f"cabide_{job_id}.png",
+            stat_result=result_stat,
+            headers={"Cache-Control": "no-store"},
+            # Per-job file: optionally drop it once sent
+            background=(
+                None
+                if settings.keep_generated_images
+                else BackgroundTask(os.remove, result_path_or_url)
+            ),
         )
 
     except HTTPException:
@@ -458,11 +616,6 @@ async def generate_model_photo(
     except Exception as e:
         logger.error(f"Generation failed for job {job_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Engine Error: {str(e)}")
-    finally:
-        # Clean up all temp files
-        for temp_path in temp_paths:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
 
 
 @app.get("/health", response_model=HealthResponse)
@@ -470,17 +623,20 @@ async def health_check(settings: Settings = Depends(get_settings)):
     """
     Health check with actual connectivity verification.
     Tests Gemini API only (GCS disabled - using Drive for storage).
+    The Gemini probe result is reused for _GEMINI_HEALTH_TTL seconds so
+    frequent load balancer probes don't each call the Gemini API.
     """
+    global _gemini_health
     checks = {"gemini": False, "storage": True}
 
-    # Check Gemini API (new SDK)
-    try:
-        client = genai.Client(api_key=settings.gemini_api_key)
-        # Quick test - just check if we can list models
-        client.models.list()
-        checks["gemini"] = True
-    except Exception as e:
-        logger.warning(f"Gemini health check failed: {e}")
+    # Check Gemini API (new SDK) off the event loop
+    checked_at, gemini_ok = _gemini_health
+    now = time.monotonic()
+    if now - checked_at >= _GEMINI_HEALTH_TTL:
+        # Reuse the engine's client (and its warm connection pool)
+        gemini_ok = await asyncio.to_thread(_probe_gemini, engine.client)
+        _gemini_health = (now, gemini_ok)
+    checks["gemini"] = gemini_ok
 
     # Storage check - always healthy (local + Drive)
     checks["storage"] = True
@@ -494,58 +650,39 @@ async def health_check(settings: Settings = Depends(get_settings)):
     )
 
 
-@app.get("/oauth/callback")
-async def oauth_callback(
-    code: Optional[str] = None, state: Optional[str] = None, error: Optional[str] = None
-):
-    """
-    OAuth callback endpoint for Google authentication.
-    Redirects user with code to complete authentication in Streamlit app.
-    """
-    from fastapi.responses import HTMLResponse
-
-    if error:
-        return HTMLResponse(
-            content=f"""
+# --- OAuth Callback Pages ---
+# Built once at import; only the escaped code/error is spliced in per request.
+_CALLBACK_ERROR_PREFIX = """
             <html>
                 <body>
                     <h1>❌ Erro na autenticação</h1>
-                    <p>Erro: {error}</p>
+                    <p>Erro: """
+_CALLBACK_ERROR_SUFFIX = """</p>
                     <p>Feche esta janela e tente novamente.</p>
                 </body>
             </html>
-            """,
-            status_code=400,
-        )
-
-    if not code:
-        return HTMLResponse(
-            content="""
+            """
+_CALLBACK_MISSING_CODE_PAGE = """
             <html>
                 <body>
                     <h1>❌ Código de autorização não encontrado</h1>
                     <p>Feche esta janela e tente novamente.</p>
                 </body>
             </html>
-            """,
-            status_code=400,
-        )
-
-    # Show success page with code that user can copy
-    return HTMLResponse(
-        content=f"""
+            """
+_CALLBACK_SUCCESS_PREFIX = """
         <html>
             <head>
                 <title>✅ Autenticação Bem-Sucedida</title>
                 <style>
-                    body {{
+                    body {
                         font-family: Arial, sans-serif;
                         max-width: 800px;
                         margin: 50px auto;
                         padding: 20px;
                         text-align: center;
-                    }}
-                    .code-box {{
+                    }
+                    .code-box {
                         background: #f5f5f5;
                         padding: 20px;
                         border-radius: 8px;
@@ -553,8 +690,8 @@ async def oauth_callback(
                         word-break: break-all;
                         font-family: monospace;
                         font-size: 14px;
-                    }}
-                    button {{
+                    }
+                    button {
                         background: #4CAF50;
                         color: white;
                         padding: 15px 32px;
@@ -562,29 +699,54 @@ async def oauth_callback(
                         border: none;
                         border-radius: 4px;
                         cursor: pointer;
-                    }}
-                    button:hover {{
+                    }
+                    button:hover {
                         background: #45a049;
-                    }}
+                    }
                 </style>
             </head>
             <body>
                 <h1>✅ Autenticação Bem-Sucedida!</h1>
                 <p>Copie o código abaixo e cole no app Cabide AI:</p>
-                <div class="code-box" id="authCode">{code}</div>
+                <div class="code-box" id="authCode">"""
+_CALLBACK_SUCCESS_SUFFIX = """</div>
                 <button onclick="copyCode()">📋 Copiar Código</button>
                 <p style="margin-top: 30px; color: #666;">Você pode fechar esta janela após copiar o código.</p>
                 <script>
-                    function copyCode() {{
+                    function copyCode() {
                         const code = document.getElementById('authCode').textContent;
-                        navigator.clipboard.writeText(code).then(function() {{
+                        navigator.clipboard.writeText(code).then(function() {
                             alert('✅ Código copiado!');
-                        }}, function() {{
+                        }, function() {
                             alert('❌ Erro ao copiar. Copie manualmente.');
-                        }});
-                    }}
+                        });
+                    }
                 </script>
             </body>
         </html>
         """
+
+
+@app.get("/oauth/callback")
+async def oauth_callback(
+    code: Optional[str] = None, state: Optional[str] = None, error: Optional[str] = None
+):
+    """
+    OAuth callback endpoint for Google authentication.
+    Redirects user with code to complete authentication in Streamlit app.
+    """
+    if error:
+        return HTMLResponse(
+            content=_CALLBACK_ERROR_PREFIX
+            + html.escape(error)
+            + _CALLBACK_ERROR_SUFFIX,
+            status_code=400,
+        )
+
+    if not code:
+        return HTMLResponse(content=_CALLBACK_MISSING_CODE_PAGE, status_code=400)
+
+    # Show success page with code that user can copy
+    return HTMLResponse(
+        content=_CALLBACK_SUCCESS_PREFIX + html.escape(code) + _CALLBACK_SUCCESS_SUFFIX
     )
@@ -6,6 +6,9 @@ Handles communication between Streamlit UI and FastAPI backend.
 from typing import BinaryIO, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+from urllib3.util.retry import Retry
 
 from src.config import get_settings
 
@@ -33,6 +36,29 @@ class CabideAPIClient:
         if self.access_token:
             self.headers["Authorization"] = f"Bearer {self.access_token}"
 
+        # Keep-alive session so repeated calls reuse the TCP/TLS connection.
+        # Retry only covers idempotent data calls, so /generate is never re-sent.
+        self._session = requests.Session()
+        self._session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(
+                total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504)
+            ),
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # The health probe must fail fast: a retry loop would hide a down backend
+        # behind seconds of backoff. Longest prefix wins, so only /health uses it.
+        self._session.mount(
+            f"{self.base_url}/health", HTTPAdapter(max_retries=Retry(total=0))
+        )
+
+    def close(self) -> None:
+        """Close the underlying HTTP session and its pooled connections."""
+        self._session.close()
+
     def health_check(self) -> dict:
         """
         Check if backend is healthy.
@@ -43,9 +69,7 @@ class CabideAPIClient:
         Raises:
             requests.RequestException: If request fails
         """
-        response = requests.get(
-            f"{self.base_url}/health", headers=self.headers, timeout=5
-        )
+        response = self._session.get(f"{self.base_url}/health", timeout=5)
         response.raise_for_status()
         return response.json()
 
@@ -87,12 +111,6 @@ class CabideAPIClient:
         if not isinstance(image_files, list):
             image_files = [image_files]
 
-        # Prepare files for upload
-        files = [
-            ("files", (filename, file_obj, "image/png"))
-            for filename, file_obj in image_files
-        ]
-
         data = {"env": environment}
 
         # Add metadata if provided
@@ -111,11 +129,19 @@ class CabideAPIClient:
         if piece3_type:
             data["piece3_type"] = piece3_type
 
-        response = requests.post(
+        # Stream the multipart body from the file objects instead of buffering it
+        encoder = MultipartEncoder(
+            fields=list(data.items())
+            + [
+                ("files", (filename, file_obj, "image/png"))
+                for filename, file_obj in image_files
+            ]
+        )
+
+        response = self._session.post(
             f"{self.base_url}/generate",
-            files=files,
-            data=data,
-            headers=self.headers,
+            data=encoder,
+            headers={"Content-Type": encoder.content_type},
             timeout=180,  # 3 minutes - Gemini can take time, especially for conjuntos
         )
         response.raise_for_status()
@@ -1,15 +1,34 @@
+import hashlib
 import io
-import os
+import time
+from typing import Optional
 
 import requests
 import streamlit as st
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from src.api_client import CabideAPIClient
 from src.auth_ui import require_authentication
 from src.config import Settings, get_settings
 from src.driver_service import DriveService
-from src.engine import FashionEngine
+from src.engine import TYPE_NORMALIZATION, FashionEngine
 from src.oauth_helper import UnifiedOAuthHelper
+from src.ui_options import (
+    ACTIVITY_LABEL_KEYS,
+    ACTIVITY_LABELS,
+    ENV_LABEL_KEYS,
+    ENV_LABELS,
+    GARMENT_TYPES,
+    UPLOAD_HELP_TEXT,
+)
+
+# Seconds a successful backend health check is reused across reruns
+HEALTH_CHECK_TTL = 30.0
+
+# st.image scales anything wider than this down (and re-encodes it) on every call
+PREVIEW_MAX_WIDTH = 1460
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -47,6 +66,42 @@ def get_drive_manager(_settings: Settings, _oauth_helper: UnifiedOAuthHelper):
     return None
 
 
+@st.cache_resource(max_entries=32, ttl=3600)
+def get_api_client(backend_url: str, access_token: Optional[str]) -> CabideAPIClient:
+    """
+    One API client (and its pooled session) per backend URL and access token.
+    Tokens last about an hour, so entries expire with them.
+    """
+    return CabideAPIClient(backend_url, access_token=access_token)
+
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """Shared keep-alive session for downloading generated images by URL.
+
+    Only the connection pool is shared; responses are never cached.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=2, backoff_factor=0.2),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_image(url: str) -> bytes:
+    """Download a generated image through get_http_session(), uncached.
+
+    Every call hits the URL, so a regenerated image is never served stale.
+    """
+    response = get_http_session().get(url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+
 # Load Resources
 settings = get_settings()
 oauth_helper = get_oauth_helper()
@@ -64,8 +119,14 @@ if settings.backend_url:
     try:
         # Get OAuth access token for API authentication
         access_token = oauth_helper.get_access_token()
-        api_client = CabideAPIClient(settings.backend_url, access_token=access_token)
-        api_status = api_client.health_check()
+        api_client = get_api_client(settings.backend_url, access_token)
+        # Streamlit reruns on every widget change; only re-probe after the TTL
+        now = time.monotonic()
+        last_checked = st.session_state.get("api_health_checked_at", float("-inf"))
+        if now - last_checked > HEALTH_CHECK_TTL:
+            st.session_state.api_status = api_client.health_check()
+            st.session_state.api_health_checked_at = now
+        api_status = st.session_state.api_status
         st.sidebar.success(f"✅ API Connected: v{api_status.get('version', 'unknown')}")
     except Exception as e:
         st.sidebar.warning(f"⚠️ API unavailable: {e}\nUsing direct engine mode")
@@ -75,66 +136,15 @@ if settings.backend_url:
 st.title("👗 Cabide AI")
 st.markdown("### Gerador de Catálogo Profissional para o Cabide da Ieié")
 
-# --- UI Controls ---
-with st.expander("🎨 Scene Customization", expanded=True):
-    col1, col2 = st.columns(2)
-    with col1:
-        # Map PT labels to values for the engine
-        env_labels = {
-            "Praia (Beach)": "beach",
-            "Floresta (Forest)": "forest",
-            "Cidade (Urban Street)": "urban street",
-            "Parque (Park)": "park",
-            "Festa (Party)": "luxury party ballroom",
-            "Escritório (Office)": "office",
-            "Congresso (Congress Hall)": "congress hall",
-            "Consultório (Medical Office)": "medical office",
-        }
-        selected_env_label = st.selectbox("Select Environment", list(env_labels.keys()))
-        env_value = env_labels[selected_env_label]
-
-    with col2:
-        # Activity selection
-        activity_labels = {
-            "Caminhando (Walking)": "walking",
-            "Lendo (Reading)": "reading",
-            "Tomando Café (Coffee)": "holding a coffee",
-            "Posando (Posing)": "posing elegantly",
-            "No Celular (On Phone)": "checking phone",
-            "Fazendo Apresentação (Presenting)": "standing and presenting to an audience with confident body language",
-            "Atendendo Cliente (Attending Client)": "attending to a client",
-        }
-        selected_act_label = st.selectbox(
-            "Model Activity", list(activity_labels.keys())
-        )
-        act_value = activity_labels[selected_act_label]
-
 # --- Garment Metadata Section ---
+# Type, position and the Conjunto pieces stay outside the generate form: the
+# position field, the Conjunto section and the upload hint react to them at once
 with st.expander("📋 Dados da Peça", expanded=True):
-    col_num, col_type, col_position = st.columns(3)
-    with col_num:
-        garment_number = st.text_input(
-            "Número da Peça *",
-            placeholder="Ex: 100",
-            help="Número único da peça para o catálogo",
-        )
+    col_type, col_position = st.columns(2)
     with col_type:
         garment_type = st.selectbox(
             "Tipo da Peça *",
-            [
-                "",
-                "Vestido",
-                "Vestido de Festa",
-                "Calça",
-                "Camisa",
-                "Saia",
-                "Sapato",
-                "Écharpe",
-                "Bracelete",
-                "Veste",
-                "Conjunto",
-                "Vestido com Modelo",
-            ],
+            GARMENT_TYPES,
             help="Selecione o tipo de roupa. 'Vestido com Modelo' = trocar apenas o fundo",
         )
     with col_position:
@@ -179,443 +189,298 @@ if garment_type == "Conjunto":
                 help="Veste, sapato, acessório ou complemento (opcional)",
             )
 
-# --- Model Attributes (Optional) ---
-model_height = None
-model_body_type = None
-model_skin_tone = None
-model_hair_length = None
-model_hair_texture = None
-model_hair_color = None
-model_hair_style = None
-
-with st.expander("👤 Características da Modelo (Opcional)", expanded=False):
-    st.caption(
-        "Personalize a aparência da modelo virtual. Se não preencher, usaremos características aleatórias."
-    )
+# --- Generate Form ---
+# Everything else (number, scene, model attributes, uploads) is batched in one
+# form so editing it reruns the script once, on submit
+generate_form = st.form("generate_form", border=False)
+
+garment_number = generate_form.text_input(
+    "Número da Peça *",
+    placeholder="Ex: 100",
+    help="Número único da peça para o catálogo",
+)
 
+with generate_form.expander("🎨 Scene Customization", expanded=True):
     col1, col2 = st.columns(2)
     with col1:
-        model_height = st.selectbox(
-            "Altura", ["", "Baixa", "Média", "Alta"], help="Estatura da modelo"
-        )
-        model_body_type = st.selectbox(
-            "Tipo Físico",
-            ["", "Esguia", "Média", "Plus Size"],
-            help="Biotipo da modelo",
-        )
-        model_skin_tone = st.selectbox(
-            "Tom de Pele",
-            [
-                "",
-                "Pele Clara",
-                "Pele Média",
-                "Pele Morena",
-                "Pele Escura",
-                "Pele Negra",
-            ],
-            help="Tonalidade de pele",
-        )
+        selected_env_label = st.selectbox("Select Environment", ENV_LABEL_KEYS)
+        env_value = ENV_LABELS[selected_env_label]
 
     with col2:
-        model_hair_length = st.selectbox(
-            "Cabelo - Comprimento",
-            ["", "Curto", "Médio", "Longo"],
-            help="Comprimento do cabelo",
-        )
-        model_hair_texture = st.selectbox(
-            "Cabelo - Textura",
-            ["", "Liso", "Ondulado", "Cacheado", "Crespo"],
-            help="Textura natural do cabelo",
-        )
-        model_hair_color = st.selectbox(
-            "Cabelo - Cor",
-            ["", "Loiro", "Castanho", "Ruivo", "Preto", "Grisalho"],
-            help="Cor do cabelo",
-        )
-        model_hair_style = st.selectbox(
-            "Cabelo - Estilo",
-            ["", "Solto", "Preso", "Coque", "Rabo de Cavalo"],
-            help="Estilo do penteado",
+        # Activity selection
+        selected_act_label = st.selectbox("Model Activity", ACTIVITY_LABEL_KEYS)
+        act_value = ACTIVITY_LABELS[selected_act_label]
+
+# --- Model Attributes (Optional) ---
+# Choices live in session state so they survive the expander being collapsed
+model_attr_choices = st.session_state.setdefault("model_attrs", {})
+
+
+def model_attribute_select(field: str, label: str, options: list[str], help: str):
+    """Selectbox for one model attribute, restored from session state on reopen."""
+    key = f"model_{field}"
+    if key not in st.session_state:
+        st.session_state[key] = model_attr_choices.get(field, "")
+    model_attr_choices[field] = st.selectbox(label, options, key=key, help=help)
+
+
+# Lazy expander: the selectboxes are only built while it is open
+model_expander = generate_form.expander(
+    "👤 Características da Modelo (Opcional)",
+    expanded=False,
+    key="model_attrs_expander",
+    on_change="rerun",
+)
+if model_expander.open:
+    with model_expander:
+        st.caption(
+            "Personalize a aparência da modelo virtual. Se não preencher, usaremos características aleatórias."
         )
 
+        col1, col2 = st.columns(2)
+        with col1:
+            model_attribute_select(
+                "height", "Altura", ["", "Baixa", "Média", "Alta"], "Estatura da modelo"
+            )
+            model_attribute_select(
+                "body_type",
+                "Tipo Físico",
+                ["", "Esguia", "Média", "Plus Size"],
+                "Biotipo da modelo",
+            )
+            model_attribute_select(
+                "skin_tone",
+                "Tom de Pele",
+                [
+                    "",
+                    "Pele Clara",
+                    "Pele Média",
+                    "Pele Morena",
+                    "Pele Escura",
+                    "Pele Negra",
+                ],
+                "Tonalidade de pele",
+            )
+
+        with col2:
+            model_attribute_select(
+                "hair_length",
+                "Cabelo - Comprimento",
+                ["", "Curto", "Médio", "Longo"],
+                "Comprimento do cabelo",
+            )
+            model_attribute_select(
+                "hair_texture",
+                "Cabelo - Textura",
+                ["", "Liso", "Ondulado", "Cacheado", "Crespo"],
+                "Textura natural do cabelo",
+            )
+            model_attribute_select(
+                "hair_color",
+                "Cabelo - Cor",
+                ["", "Loiro", "Castanho", "Ruivo", "Preto", "Grisalho"],
+                "Cor do cabelo",
+            )
+            model_attribute_select(
+                "hair_style",
+                "Cabelo - Estilo",
+                ["", "Solto", "Preso", "Coque", "Rabo de Cavalo"],
+                "Estilo do penteado",
+            )
+
 # --- File Upload Section ---
 # Multi-file upload for Front/Back support or Conjunto pieces
 if garment_type == "Conjunto":
     num_pieces = 2 if not piece3_type else 3
-    st.info(
+    generate_form.info(
         f"📸 Envie {num_pieces} fotos separadas na ordem: 1) {piece1_type or 'Peça Superior'}, 2) {piece2_type or 'Peça Inferior'}"
         + (f", 3) {piece3_type}" if piece3_type else "")
     )
 elif garment_type == "Vestido com Modelo":
-    st.info(
+    generate_form.info(
         "📸 Envie 1 foto do vestido já vestido na modelo. O sistema irá trocar apenas o fundo/ambiente."
     )
 else:
-    upload_help_text = {
-        "Frente": "Envie 1 ou mais fotos da frente",
-        "Costas": "Envie 1 ou mais fotos das costas",
-        "Ambos": "Envie 2 fotos: frente e costas (recomendado para vestidos)",
-    }
-    st.info(
-        f"📸 {upload_help_text.get(position, 'Envie as fotos da peça')} • Se não tiver foto das costas, usamos a frente."
+    generate_form.info(
+        f"📸 {UPLOAD_HELP_TEXT.get(position, 'Envie as fotos da peça')} • Se não tiver foto das costas, usamos a frente."
     )
 
-uploaded_files = st.file_uploader(
+uploaded_files = generate_form.file_uploader(
     "Envie fotos da peça (1 ou 2 fotos)",
     type=["png", "jpg", "jpeg", "heic", "heif"],
     accept_multiple_files=True,
 )
 
-if st.button("✨ Gerar foto profissional", use_container_width=True):
-    if uploaded_files:
-        # Validate metadata
-        if not garment_number or not garment_number.strip():
-            st.error("⚠️ Por favor, preencha o Número da Peça")
-        elif not garment_type:
-            st.error("⚠️ Por favor, selecione o Tipo da Peça")
-        elif garment_type == "Conjunto" and (not piece1_type or not piece2_type):
-            st.error(
-                "⚠️ Por favor, selecione a Peça Superior e Peça Inferior do conjunto"
+
+# --- Generation ---
+def image_digest(image_bytes: bytes) -> str:
+    """Short content hash identifying a generated image (e.g. for Drive upload keys)."""
+    return hashlib.blake2b(image_bytes, digest_size=4).hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def preview_image(image_hash: str, _image_bytes: bytes) -> bytes:
+    """
+    JPEG preview of a generated image, at most PREVIEW_MAX_WIDTH wide.
+    st.image passes it through untouched, instead of re-encoding the PNG on every rerun.
+    Cached by image_hash, so the multi-MB PNG itself is never hashed on a rerun.
+    """
+    with Image.open(io.BytesIO(_image_bytes)) as img:
+        img = img.convert("RGB")
+        img.thumbnail((PREVIEW_MAX_WIDTH, img.height))
+        preview = io.BytesIO()
+        img.save(preview, format="JPEG", quality=90)
+    return preview.getvalue()
+
+
+def load_result_image(result) -> bytes:
+    """Return the image bytes for an engine result (local path or URL)."""
+    if isinstance(result, list):
+        result = result[0]  # Take first if multiple envs
+
+    if result.startswith("http"):
+        # Production Mode: download it (uncached) over the shared session
+        return fetch_image(result)
+
+    # Local Mode: Read from disk
+    with open(result, "rb") as f:
+        return f.read()
+
+
+def run_generation(
+    uploaded_files,
+    *,
+    garment_number: str,
+    garment_type: str,
+    position: str,
+    env_value: str,
+    act_value: str,
+    conjunto_data: dict | None,
+    model_attrs: dict,
+) -> bytes:
+    """Generate the photo via the API or directly with the engine."""
+    # UploadedFile is already an in-memory file: hand it over without copying
+    for uploaded_file in uploaded_files:
+        uploaded_file.seek(0)
+
+    if api_client is not None and settings.backend_url:
+        # API MODE: Call backend
+        result = api_client.generate_photo(
+            image_files=[(f.name, f) for f in uploaded_files],
+            environment=env_value,
+            activity=act_value,
+            garment_number=garment_number,
+            garment_type=garment_type,
+            position=position,
+            piece1_type=conjunto_data["piece1_type"] if conjunto_data else None,
+            piece2_type=conjunto_data["piece2_type"] if conjunto_data else None,
+            piece3_type=(conjunto_data["piece3_type"] or None)
+            if conjunto_data
+            else None,
+        )
+
+        if "url" in result:
+            # Production mode: download it (uncached) over the shared session
+            return fetch_image(result["url"])
+        # Local mode: Use returned bytes
+        return result["image_bytes"]
+
+    # DIRECT ENGINE MODE
+    # HEIC is passed through as-is: the engine decodes it once and re-encodes to JPEG
+    # Call Engine (Handles single/list inputs and front/back logic)
+    result = engine.generate_lifestyle_photo(
+        garment_path=list(uploaded_files),
+        environment=env_value,
+        activity=act_value,
+        garment_number=garment_number,
+        garment_type=garment_type,
+        position=position,
+        conjunto_pieces=conjunto_data,
+        model_attributes=model_attrs if model_attrs else None,
+    )
+    return load_result_image(result)
+
+
+if generate_form.form_submit_button(
+    "✨ Gerar foto profissional", use_container_width=True
+):
+    if not uploaded_files:
+        st.error("Por favor, envie pelo menos uma foto da peça.")
+    # Validate metadata
+    elif not garment_number or not garment_number.strip():
+        st.error("⚠️ Por favor, preencha o Número da Peça")
+    elif not garment_type:
+        st.error("⚠️ Por favor, selecione o Tipo da Peça")
+    elif garment_type == "Conjunto" and (not piece1_type or not piece2_type):
+        st.error("⚠️ Por favor, selecione a Peça Superior e Peça Inferior do conjunto")
+    elif garment_type == "Conjunto" and len(uploaded_files) != (
+        3 if piece3_type else 2
+    ):
+        st.error(
+            f"⚠️ Por favor, envie exatamente {3 if piece3_type else 2} fotos para o conjunto ({len(uploaded_files)} enviada(s))"
+        )
+    else:
+        # Optional: Show info if user selected "Ambos" but only uploaded 1 photo
+        if (
+            garment_type != "Conjunto"
+            and position == "Ambos"
+            and len(uploaded_files) == 1
+        ):
+            st.info(
+                "ℹ️ Você selecionou 'Ambos' mas enviou apenas 1 foto. Vamos usar a mesma foto para frente e costas."
             )
-        elif garment_type == "Conjunto":
-            expected_photos = 2 if not piece3_type else 3
-            if len(uploaded_files) != expected_photos:
-                st.error(
-                    f"⚠️ Por favor, envie exatamente {expected_photos} fotos para o conjunto ({len(uploaded_files)} enviada(s))"
-                )
-            else:
-                # Conjunto validation passed - proceed with generation
-                with st.spinner("Banana Pro is generating your image..."):
-                    try:
-                        # Determine mode: API or Direct Engine
-                        use_api = api_client is not None and settings.backend_url
-
-                        if use_api:
-                            # API MODE: Call backend
-                            # Save temp files for feedback regeneration
-                            temp_paths = []
-                            for idx, uploaded_file in enumerate(uploaded_files):
-                                temp_name = f"temp_{idx}_{uploaded_file.name}"
-                                with open(temp_name, "wb") as f:
-                                    f.write(uploaded_file.getbuffer())
-                                temp_paths.append(temp_name)
-
-                            # Prepare conjunto metadata (for session state)
-                            conjunto_data = None
-                            if garment_type == "Conjunto":
-                                conjunto_data = {
-                                    "piece1_type": piece1_type,
-                                    "piece2_type": piece2_type,
-                                    "piece3_type": piece3_type,
-                                }
-
-                            # Prepare model attributes (for session state)
-                            model_attrs = {
-                                "height": model_height,
-                                "body_type": model_body_type,
-                                "skin_tone": model_skin_tone,
-                                "hair_length": model_hair_length,
-                                "hair_texture": model_hair_texture,
-                                "hair_color": model_hair_color,
-                                "hair_style": model_hair_style,
-                            }
-                            # Filter out empty values
-                            model_attrs = {k: v for k, v in model_attrs.items() if v}
-
-                            # Prepare all files for API
-                            image_files = []
-                            for uploaded_file in uploaded_files:
-                                image_buffer = io.BytesIO(uploaded_file.getbuffer())
-                                image_buffer.seek(0)
-                                image_files.append((uploaded_file.name, image_buffer))
-
-                            result = api_client.generate_photo(
-                                image_files=image_files,
-                                environment=env_value,
-                                activity=act_value,
-                                garment_number=garment_number.strip(),
-                                garment_type=garment_type,
-                                position=position,
-                                piece1_type=piece1_type
-                                if garment_type == "Conjunto"
-                                else None,
-                                piece2_type=piece2_type
-                                if garment_type == "Conjunto"
-                                else None,
-                                piece3_type=piece3_type
-                                if garment_type == "Conjunto" and piece3_type
-                                else None,
-                            )
 
-                            if "url" in result:
-                                # Production mode: Fetch from URL
-                                response = requests.get(result["url"])
-                                image_bytes = response.content
-                            else:
-                                # Local mode: Use returned bytes
-                                image_bytes = result["image_bytes"]
-                        else:
-                            # DIRECT ENGINE MODE (current behavior)
-                            # 1. Handle multiple temp files for the engine
-                            temp_paths = []
-                            for idx, uploaded_file in enumerate(uploaded_files):
-                                temp_name = f"temp_{idx}_{uploaded_file.name}"
-                                with open(temp_name, "wb") as f:
-                                    f.write(uploaded_file.getbuffer())
-
-                                # Convert HEIC to PNG if needed
-                                if uploaded_file.name.lower().endswith(
-                                    (".heic", ".heif")
-                                ):
-                                    try:
-                                        from PIL import Image
-                                        from pillow_heif import register_heif_opener
-
-                                        register_heif_opener()
-                                        img = Image.open(temp_name)
-
-                                        # Convert to PNG
-                                        png_name = f"temp_{idx}_converted.png"
-                                        img.save(png_name, format="PNG")
-
-                                        # Remove HEIC and use PNG
-                                        os.remove(temp_name)
-                                        temp_name = png_name
-                                    except Exception as e:
-                                        st.error(f"Failed to convert HEIC image: {e}")
-                                        raise
-
-                                temp_paths.append(temp_name)
-
-                            # 2. Prepare conjunto metadata if applicable
-                            conjunto_data = None
-                            if garment_type == "Conjunto":
-                                conjunto_data = {
-                                    "piece1_type": piece1_type,
-                                    "piece2_type": piece2_type,
-                                    "piece3_type": piece3_type,
-                                }
-
-                            # 2.5. Prepare model attributes if provided
-                            model_attrs = {
-                                "height": model_height,
-                                "body_type": model_body_type,
-                                "skin_tone": model_skin_tone,
-                                "hair_length": model_hair_length,
-                                "hair_texture": model_hair_texture,
-                                "hair_color": model_hair_color,
-                                "hair_style": model_hair_style,
-                            }
-                            # Filter out empty values
-                            model_attrs = {k: v for k, v in model_attrs.items() if v}
-
-                            # 3. Call Engine (Handles single/list paths and front/back logic)
-                            result = engine.generate_lifestyle_photo(
-                                garment_path=temp_paths,
-                                environment=env_value,
-                                activity=act_value,
-                                garment_number=garment_number.strip(),
-                                garment_type=garment_type,
-                                position=position,
-                                conjunto_pieces=conjunto_data,
-                                model_attributes=model_attrs if model_attrs else None,
-                            )
+        with st.spinner("Banana Pro is generating your image..."):
+            try:
+                # Prepare conjunto metadata if applicable
+                conjunto_data = None
+                if garment_type == "Conjunto":
+                    conjunto_data = {
+                        "piece1_type": piece1_type,
+                        "piece2_type": piece2_type,
+                        "piece3_type": piece3_type,
+                    }
 
-                            # 3. Handle result data for Download/Drive
-                            if isinstance(result, list):
-                                result = result[0]  # Take first if multiple envs
-
-                            if result.startswith("http"):
-                                # Production Mode: Fetch from GCS
-                                response = requests.get(result)
-                                image_bytes = response.content
-                            else:
-                                # Local Mode: Read from disk
-                                with open(result, "rb") as f:
-                                    image_bytes = f.read()
-
-                            # DON'T cleanup temp files yet - keep them for feedback/regeneration
-                            # They will be cleaned up when a new generation starts
-
-                        # 4. Display Results
-                        st.success("Generation Complete!")
-
-                        # Store in session state for feedback/regeneration
-                        st.session_state.last_image_bytes = image_bytes
-                        st.session_state.last_temp_paths = temp_paths
-                        st.session_state.last_params = {
-                            "env_value": env_value,
-                            "act_value": act_value,
-                            "garment_number": garment_number,
-                            "garment_type": garment_type,
-                            "position": position,
-                            "conjunto_data": conjunto_data,
-                            "model_attrs": model_attrs if model_attrs else None,
-                            "selected_env_label": selected_env_label,
-                            "selected_act_label": selected_act_label,
-                        }
-
-                    except Exception as e:
-                        st.error(f"Engine Error: {e}")
-        else:
-            # Non-conjunto items
-            # Optional: Show info if user selected "Ambos" but only uploaded 1 photo
-            if position == "Ambos" and len(uploaded_files) == 1:
-                st.info(
-                    "ℹ️ Você selecionou 'Ambos' mas enviou apenas 1 foto. Vamos usar a mesma foto para frente e costas."
+                # Prepare model attributes, filtering out empty values
+                model_attrs = {k: v for k, v in model_attr_choices.items() if v}
+
+                image_bytes = run_generation(
+                    uploaded_files,
+                    garment_number=garment_number.strip(),
+                    garment_type=garment_type,
+                    position=position,
+                    env_value=env_value,
+                    act_value=act_value,
+                    conjunto_data=conjunto_data,
+                    model_attrs=model_attrs,
                 )
 
-            with st.spinner("Banana Pro is generating your image..."):
-                try:
-                    # Determine mode: API or Direct Engine
-                    use_api = api_client is not None and settings.backend_url
-
-                    if use_api:
-                        # API MODE: Call backend
-                        # Save temp files for feedback regeneration
-                        temp_paths = []
-                        for idx, uploaded_file in enumerate(uploaded_files):
-                            temp_name = f"temp_{idx}_{uploaded_file.name}"
-                            with open(temp_name, "wb") as f:
-                                f.write(uploaded_file.getbuffer())
-                            temp_paths.append(temp_name)
-
-                        # Prepare conjunto metadata (for session state)
-                        conjunto_data = None
-
-                        # Prepare model attributes (for session state)
-                        model_attrs = {
-                            "height": model_height,
-                            "body_type": model_body_type,
-                            "skin_tone": model_skin_tone,
-                            "hair_length": model_hair_length,
-                            "hair_texture": model_hair_texture,
-                            "hair_color": model_hair_color,
-                            "hair_style": model_hair_style,
-                        }
-                        # Filter out empty values
-                        model_attrs = {k: v for k, v in model_attrs.items() if v}
-
-                        # Prepare all files for API
-                        image_files = []
-                        for uploaded_file in uploaded_files:
-                            image_buffer = io.BytesIO(uploaded_file.getbuffer())
-                            image_buffer.seek(0)
-                            image_files.append((uploaded_file.name, image_buffer))
-
-                        result = api_client.generate_photo(
-                            image_files=image_files,
-                            environment=env_value,
-                            activity=act_value,
-                            garment_number=garment_number.strip(),
-                            garment_type=garment_type,
-                            position=position,
-                        )
-
-                        if "url" in result:
-                            # Production mode: Fetch from URL
-                            response = requests.get(result["url"])
-                            image_bytes = response.content
-                        else:
-                            # Local mode: Use returned bytes
-                            image_bytes = result["image_bytes"]
-                    else:
-                        # DIRECT ENGINE MODE (current behavior)
-                        # 1. Handle multiple temp files for the engine
-                        temp_paths = []
-                        for idx, uploaded_file in enumerate(uploaded_files):
-                            temp_name = f"temp_{idx}_{uploaded_file.name}"
-                            with open(temp_name, "wb") as f:
-                                f.write(uploaded_file.getbuffer())
-
-                            # Convert HEIC to PNG if needed
-                            if uploaded_file.name.lower().endswith((".heic", ".heif")):
-                                try:
-                                    from PIL import Image
-                                    from pillow_heif import register_heif_opener
-
-                                    register_heif_opener()
-                                    img = Image.open(temp_name)
-
-                                    # Convert to PNG
-                                    png_name = f"temp_{idx}_converted.png"
-                                    img.save(png_name, format="PNG")
-
-                                    # Remove HEIC and use PNG
-                                    os.remove(temp_name)
-                                    temp_name = png_name
-                                except Exception as e:
-                                    st.error(f"Failed to convert HEIC image: {e}")
-                                    raise
-
-                            temp_paths.append(temp_name)
-
-                        # 2. Prepare conjunto metadata if applicable (will be None for non-conjunto)
-                        conjunto_data = None
-
-                        # 2.5. Prepare model attributes if provided
-                        model_attrs = {
-                            "height": model_height,
-                            "body_type": model_body_type,
-                            "skin_tone": model_skin_tone,
-                            "hair_length": model_hair_length,
-                            "hair_texture": model_hair_texture,
-                            "hair_color": model_hair_color,
-                            "hair_style": model_hair_style,
-                        }
-                        # Filter out empty values
-                        model_attrs = {k: v for k, v in model_attrs.items() if v}
-
-                        # 3. Call Engine (Handles single/list paths and front/back logic)
-                        result = engine.generate_lifestyle_photo(
-                            garment_path=temp_paths,
-                            environment=env_value,
-                            activity=act_value,
-                            garment_number=garment_number.strip(),
-                            garment_type=garment_type,
-                            position=position,
-                            conjunto_pieces=conjunto_data,
-                            model_attributes=model_attrs if model_attrs else None,
-                        )
-
-                        # 3. Handle result data for Download/Drive
-                        if isinstance(result, list):
-                            result = result[0]  # Take first if multiple envs
-
-                        if result.startswith("http"):
-                            # Production Mode: Fetch from GCS
-                            response = requests.get(result)
-                            image_bytes = response.content
-                        else:
-                            # Local Mode: Read from disk
-                            with open(result, "rb") as f:
-                                image_bytes = f.read()
-
-                        # DON'T cleanup temp files yet - keep them for feedback/regeneration
-                        # They will be cleaned up when a new generation starts
-
-                    # 4. Display Results
-                    st.success("Generation Complete!")
-
-                    # Store in session state for feedback/regeneration
-                    st.session_state.last_image_bytes = image_bytes
-                    st.session_state.last_temp_paths = temp_paths
-                    st.session_state.last_params = {
-                        "env_value": env_value,
-                        "act_value": act_value,
-                        "garment_number": garment_number,
-                        "garment_type": garment_type,
-                        "position": position,
-                        "conjunto_data": conjunto_data,
-                        "model_attrs": model_attrs if model_attrs else None,
-                        "selected_env_label": selected_env_label,
-                        "selected_act_label": selected_act_label,
-                    }
+                # Display Results
+                st.success("Generation Complete!")
 
-                except Exception as e:
-                    st.error(f"Engine Error: {e}")
-    else:
-        st.error("Por favor, envie pelo menos uma foto da peça.")
+                # Store in session state for feedback/regeneration
+                st.session_state.last_image_bytes = image_bytes
+                st.session_state.last_image_hash = image_digest(image_bytes)
+                # Keep the uploads (in memory) for feedback regeneration
+                st.session_state.last_uploads = list(uploaded_files)
+                normalized_type = TYPE_NORMALIZATION.get(
+                    garment_type.lower(), garment_type.lower()
+                )
+                st.session_state.last_params = {
+                    "env_value": env_value,
+                    "act_value": act_value,
+                    "garment_number": garment_number,
+                    "garment_type": garment_type,
+                    "position": position,
+                    "conjunto_data": conjunto_data,
+                    "model_attrs": model_attrs if model_attrs else None,
+                    "selected_env_label": selected_env_label,
+                    "selected_act_label": selected_act_label,
+                    "download_filename": f"cabide_{garment_number.strip()}_{normalized_type}.png",
+                }
+
+            except Exception as e:
+                st.error(f"Engine Error: {e}")
 
 # --- FEEDBACK SECTION (Always visible after any generation) ---
 if (
@@ -628,19 +493,14 @@ if (
     # Display the last generated image persistently
     params = st.session_state.last_params
     st.image(
-        st.session_state.last_image_bytes,
+        preview_image(
+            st.session_state.last_image_hash, st.session_state.last_image_bytes
+        ),
         caption=f"{params['selected_env_label']} | {params['selected_act_label']}",
     )
 
     # Actions: Download & Drive
-    from src.engine import TYPE_NORMALIZATION
-
-    normalized_type = TYPE_NORMALIZATION.get(
-        params["garment_type"].lower(), params["garment_type"].lower()
-    )
-    download_filename = (
-        f"cabide_{params['garment_number'].strip()}_{normalized_type}.png"
-    )
+    download_filename = params["download_filename"]
 
     col_down, col_drive = st.columns(2)
 
@@ -655,10 +515,8 @@ if (
 
     with col_drive:
         if drive_manager:
-            # Generate unique key for this specific image using hash of bytes
-            import hashlib
-
-            image_hash = hashlib.md5(st.session_state.last_image_bytes).hexdigest()[:8]
+            # Unique key for this specific image, hashed once when it was generated
+            image_hash = st.session_state.last_image_hash
             drive_url_key = f"drive_url_{download_filename}_{image_hash}"
 
             if drive_url_key in st.session_state:
@@ -710,22 +568,16 @@ if (
             try:
                 # Get parameters from session state
                 params = st.session_state.last_params
-                temp_paths = st.session_state.last_temp_paths
+                uploads = st.session_state.last_uploads
+                for upload in uploads:
+                    upload.seek(0)
 
                 # Determine mode: API or Direct Engine
                 use_api = api_client is not None and settings.backend_url
 
                 if use_api:
-                    # API MODE: Need to read temp files and send via API
-                    # Prepare all files for regeneration
-                    image_files = []
-                    for temp_path in temp_paths:
-                        with open(temp_path, "rb") as f:
-                            image_buffer = io.BytesIO(f.read())
-                            image_buffer.seek(0)
-                            image_files.append(
-                                (os.path.basename(temp_path), image_buffer)
-                            )
+                    # API MODE: Resend the kept uploads
+                    image_files = [(upload.name, upload) for upload in uploads]
 
                     # Get conjunto data if applicable
                     conjunto_data = params.get("conjunto_data")
@@ -750,16 +602,15 @@ if (
                     )
 
                     if "url" in result:
-                        # Production mode: Fetch from URL
-                        response = requests.get(result["url"])
-                        image_bytes_feedback = response.content
+                        # Production mode: download the regenerated image (uncached)
+                        image_bytes_feedback = fetch_image(result["url"])
                     else:
                         # Local mode: Use returned bytes
                         image_bytes_feedback = result["image_bytes"]
                 else:
                     # DIRECT ENGINE MODE
                     result_feedback = engine.generate_lifestyle_photo(
-                        garment_path=temp_paths,
+                        garment_path=uploads,
                         environment=params["env_value"],
                         activity=params["act_value"],
                         garment_number=params["garment_number"].strip(),
@@ -770,19 +621,11 @@ if (
                         feedback=feedback_text,
                     )
 
-                    # Handle result
-                    if isinstance(result_feedback, list):
-                        result_feedback = result_feedback[0]
-
-                    if result_feedback.startswith("http"):
-                        response = requests.get(result_feedback)
-                        image_bytes_feedback = response.content
-                    else:
-                        with open(result_feedback, "rb") as f:
-                            image_bytes_feedback = f.read()
+                    image_bytes_feedback = load_result_image(result_feedback)
 
                 # Update session state with new image (this will make it the "current" image)
                 st.session_state.last_image_bytes = image_bytes_feedback
+                st.session_state.last_image_hash = image_digest(image_bytes_feedback)
 
                 # Force rerun to show updated image and clear text area
                 st.rerun()
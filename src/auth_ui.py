@@ -3,6 +3,8 @@ Authentication UI components for Streamlit.
 Provides login, logout, and user info display.
 """
 
+import urllib.parse
+
 import streamlit as st
 
 from src.config import get_settings
@@ -100,8 +102,6 @@ def show_login_ui(oauth_helper: UnifiedOAuthHelper):
                         # Check if input is a URL or just a code
                         if user_input.startswith("http"):
                             # Extract code from URL
-                            import urllib.parse
-
                             parsed = urllib.parse.urlparse(user_input)
                             params = urllib.parse.parse_qs(parsed.query)
 
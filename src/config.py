@@ -4,8 +4,9 @@ Uses Pydantic v2 settings with proper environment variable handling.
 """
 
 import json
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 from pydantic import Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -71,10 +72,28 @@ class Settings(BaseSettings):
     enable_test_endpoint: bool = Field(
         default=False, validation_alias="ENABLE_TEST_ENDPOINT"
     )  # Only enable for local dev
+    oauth_cache_ttl: int = Field(
+        default=300, validation_alias="OAUTH_CACHE_TTL"
+    )  # Seconds to cache verified OAuth tokens (0 disables)
+    max_concurrent_generations: int = Field(
+        default=4, ge=1, validation_alias="MAX_CONCURRENT_GENERATIONS"
+    )  # Gemini calls in flight per worker
+    keep_generated_images: bool = Field(
+        default=True, validation_alias="KEEP_GENERATED_IMAGES"
+    )  # False deletes each output once sent (Drive is the permanent storage)
 
     # Image Processing Configuration (Gemini 3 Optimization)
     max_image_dimension: int = Field(default=1536)  # MEDIUM resolution for Gemini
     image_quality: int = Field(default=90)  # JPEG quality for compressed uploads
+    resample_filter: Literal["bicubic", "lanczos"] = Field(
+        default="bicubic"
+    )  # Downscale filter for uploads (bicubic is ~2x cheaper than lanczos)
+    max_upload_bytes: int = Field(
+        default=50 * 1024 * 1024, validation_alias="MAX_UPLOAD_BYTES"
+    )  # Per-file upload limit (413 above it)
+    max_request_bytes: int = Field(
+        default=160 * 1024 * 1024, validation_alias="MAX_REQUEST_BYTES"
+    )  # Whole /generate body limit, enforced before it is read (3 photos + form)
 
     # Version
     version: str = "1.2.0"
@@ -134,12 +153,7 @@ class Settings(BaseSettings):
 
 
 # Singleton pattern for settings
-_settings_instance: Optional[Settings] = None
-
-
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
     """Get or create the singleton Settings instance."""
-    global _settings_instance
-    if _settings_instance is None:
-        _settings_instance = Settings()
-    return _settings_instance
+    return Settings()
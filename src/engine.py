@@ -1,13 +1,14 @@
 import logging
+import math
 import random
 import re
 from io import BytesIO
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import BinaryIO, List, Optional, Union
 
 from google import genai
 from google.genai import types
-from PIL import Image
+from PIL import ExifTags, Image, ImageOps
 
 # Register HEIC support for PIL
 try:
@@ -21,6 +22,12 @@ from src.config import Settings, get_settings
 
 logger = logging.getLogger("CabideEngine")
 
+# Resampling filters selectable via settings.resample_filter
+_RESAMPLE_FILTERS = {
+    "bicubic": Image.Resampling.BICUBIC,
+    "lanczos": Image.Resampling.LANCZOS,
+}
+
 # Type normalization mapping (French/Portuguese → Portuguese)
 TYPE_NORMALIZATION = {
     "pantalon": "calca",
@@ -44,6 +51,82 @@ TYPE_NORMALIZATION = {
 }
 
 
+def preprocess_image(source: BinaryIO, settings: Settings) -> BytesIO:
+    """
+    Preprocess image for Gemini 3 optimization:
+    - Resize to max_image_dimension (1536px for MEDIUM)
+    - Convert to JPEG with quality setting
+
+    The image is decoded straight from the upload and the JPEG is kept in
+    memory, so nothing is written to disk. Decoding errors surface as exceptions.
+    RGB JPEGs without EXIF already within max_image_dimension are decoded only
+    to validate them, then copied without re-encoding.
+
+    Args:
+        source: Image file object (upload, open file or buffer)
+        settings: Application settings with image processing config
+
+    Returns:
+        In-memory buffer holding the processed JPEG
+    """
+    jpg = BytesIO()
+    # Single decode pass; the source image is released as soon as the JPEG is written
+    with Image.open(source) as img:
+        max_dim = settings.max_image_dimension
+
+        # Already a small RGB JPEG without EXIF: copy the bytes as-is once a full
+        # decode proves they are intact (a truncated file raises here). Photos with
+        # EXIF (GPS, orientation) always go through the re-encode below so every
+        # image reaches Gemini upright and metadata-free
+        if (
+            img.format == "JPEG"
+            and img.mode == "RGB"
+            and "exif" not in img.info
+            and max(img.size) <= max_dim
+        ):
+            img.load()
+            source.seek(0)
+            jpg.write(source.read())
+            return jpg
+
+        # Let libjpeg downscale by 1/2, 1/4 or 1/8 while decoding; the box keeps
+        # the aspect ratio so draft never goes below the target size
+        if img.format == "JPEG" and max(img.size) > max_dim:
+            ratio = max_dim / max(img.size)
+            img.draft(
+                "RGB", (math.ceil(img.width * ratio), math.ceil(img.height * ratio))
+            )
+
+        # Apply the camera's EXIF orientation; the JPEG below is saved without EXIF
+        if img.getexif().get(ExifTags.Base.Orientation, 1) != 1:
+            img = ImageOps.exif_transpose(img)
+
+        # Convert RGBA to RGB if needed (JPEG doesn't support transparency)
+        if img.mode == "RGBA":
+            rgb_img = Image.new("RGB", img.size, (255, 255, 255))
+            rgb_img.paste(img, mask=img.getchannel("A"))  # Use alpha channel as mask
+            img = rgb_img
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        # Resize in place if needed (maintains aspect ratio, never upscales)
+        img.thumbnail(
+            (max_dim, max_dim), resample=_RESAMPLE_FILTERS[settings.resample_filter]
+        )
+
+        # Save as JPEG; single-pass baseline 4:2:0 encode, since Gemini re-encodes it
+        img.save(
+            jpg,
+            format="JPEG",
+            quality=settings.image_quality,
+            optimize=False,
+            subsampling=2,
+            progressive=False,
+        )
+
+    return jpg
+
+
 class FashionEngine:
     def __init__(self, settings: Settings = None):
         self.settings = settings or get_settings()
@@ -88,7 +171,7 @@ class FashionEngine:
 
     def generate_lifestyle_photo(
         self,
-        garment_path: Union[str, List[str]],
+        garment_path: Union[str, BinaryIO, List[Union[str, BinaryIO]]],
         environment: str = None,
         activity: str = None,
         garment_number: str = None,
@@ -97,26 +180,17 @@ class FashionEngine:
         conjunto_pieces: dict = None,
         model_attributes: dict = None,
         feedback: str = None,
+        job_id: Optional[str] = None,
     ) -> str:
-        # Handle single or list (front/back)
-        paths = [garment_path] if isinstance(garment_path, str) else garment_path
-
-        # Open images - handle both file paths and BytesIO objects
-        garment_images = []
-        for p in paths:
-            if isinstance(p, (str, Path)):
-                garment_images.append(Image.open(p))
-            else:
-                # Assume it's a file-like object (BytesIO)
-                p.seek(0)  # Reset position to start
-                garment_images.append(Image.open(p))
+        # Handle single or list (front/back); a single input may be a path or a file
+        paths = garment_path if isinstance(garment_path, list) else [garment_path]
 
         # Check filename of the first image for "vestidodefesta" logic
-        # Use default filename if input is not a path
+        # File objects (e.g. Streamlit uploads) carry it in .name
         if isinstance(paths[0], (str, Path)):
             ref_filename = Path(paths[0]).name
         else:
-            ref_filename = "garment.jpg"  # Default filename for BytesIO
+            ref_filename = getattr(paths[0], "name", None) or "garment.jpg"
 
         # Logic for random variables if not provided (Local/Batch mode)
         final_env = environment or random.choice(self.settings.environments)
@@ -163,10 +237,10 @@ class FashionEngine:
         # Add position hint if provided and multiple images (for non-conjunto)
         position_hint = ""
         if not conjunto_hint:  # Only for non-conjunto items
-            if position and len(garment_images) > 1:
+            if position and len(paths) > 1:
                 if position.lower() in ["ambos", "both"]:
                     position_hint = "\n\nNote: Image 1 shows the front view, Image 2 shows the back view."
-            elif position and len(garment_images) == 1:
+            elif position and len(paths) == 1:
                 position_map = {"frente": "front view", "costas": "back view"}
                 view = position_map.get(position.lower(), "")
                 if view:
@@ -231,10 +305,15 @@ class FashionEngine:
         # Prepare content for new SDK
         # Convert PIL images to bytes for the new API
         content_parts = [final_prompt]
-        for img in garment_images:
-            img_buffer = BytesIO()
-            img.save(img_buffer, format="JPEG", quality=self.settings.image_quality)
-            img_bytes = img_buffer.getvalue()
+        for p in paths:
+            # Downscale to max_image_dimension; inputs already preprocessed by the
+            # API are small RGB JPEGs and go through as-is
+            if isinstance(p, (str, Path)):
+                with open(p, "rb") as f:
+                    img_bytes = preprocess_image(f, self.settings).getvalue()
+            else:
+                p.seek(0)
+                img_bytes = preprocess_image(p, self.settings).getvalue()
             content_parts.append(
                 types.Part.from_bytes(data=img_bytes, mime_type="image/jpeg")
             )
@@ -351,6 +430,10 @@ class FashionEngine:
             normalized_type = self._normalize_garment_type(garment_type)
             output_filename = f"cabide_{garment_number}_{normalized_type}.png"
 
+        # Concurrent jobs for the same garment must never share an output file
+        if job_id:
+            output_filename = f"{Path(output_filename).stem}_{job_id}.png"
+
         logger.info(f"Output filename: {output_filename}")
 
         result_path = self._save_image(generated_pil, output_filename)
@@ -0,0 +1,49 @@
+"""
+Option tables for the Streamlit UI.
+Kept out of app.py, which Streamlit re-executes on every rerun, so they are built once.
+"""
+
+# Map PT labels to values for the engine
+ENV_LABELS = {
+    "Praia (Beach)": "beach",
+    "Floresta (Forest)": "forest",
+    "Cidade (Urban Street)": "urban street",
+    "Parque (Park)": "park",
+    "Festa (Party)": "luxury party ballroom",
+    "Escritório (Office)": "office",
+    "Congresso (Congress Hall)": "congress hall",
+    "Consultório (Medical Office)": "medical office",
+}
+ENV_LABEL_KEYS = tuple(ENV_LABELS)
+
+ACTIVITY_LABELS = {
+    "Caminhando (Walking)": "walking",
+    "Lendo (Reading)": "reading",
+    "Tomando Café (Coffee)": "holding a coffee",
+    "Posando (Posing)": "posing elegantly",
+    "No Celular (On Phone)": "checking phone",
+    "Fazendo Apresentação (Presenting)": "standing and presenting to an audience with confident body language",
+    "Atendendo Cliente (Attending Client)": "attending to a client",
+}
+ACTIVITY_LABEL_KEYS = tuple(ACTIVITY_LABELS)
+
+GARMENT_TYPES = (
+    "",
+    "Vestido",
+    "Vestido de Festa",
+    "Calça",
+    "Camisa",
+    "Saia",
+    "Sapato",
+    "Écharpe",
+    "Bracelete",
+    "Veste",
+    "Conjunto",
+    "Vestido com Modelo",
+)
+
+UPLOAD_HELP_TEXT = {
+    "Frente": "Envie 1 ou mais fotos da frente",
+    "Costas": "Envie 1 ou mais fotos das costas",
+    "Ambos": "Envie 2 fotos: frente e costas (recomendado para vestidos)",
+}
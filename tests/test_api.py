@@ -2,26 +2,42 @@
 Tests for FastAPI endpoints.
 """
 
+import asyncio
 from io import BytesIO
-from unittest.mock import patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
+from PIL import Image
 
-from src.api import app
+from src import api
+from src.api import (
+    _extract_metadata_from_filename,
+    _RequestSizeLimitMiddleware,
+    app,
+    verify_oauth_token,
+)
+from src.config import Settings, get_settings
 
 
 @pytest.fixture
 def client():
-    """Create test client."""
-    return TestClient(app)
+    """Create test client (started, so the lifespan resources exist)."""
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(autouse=True)
+def reset_health_cache(monkeypatch):
+    """Force every test to run a fresh Gemini health probe."""
+    monkeypatch.setattr(api, "_gemini_health", (float("-inf"), False))
 
 
 def test_health_endpoint_returns_200(client, test_env_vars):
     """Test health check endpoint returns 200."""
-    # Mock the new SDK's Client class and models.list() method
-    with patch("src.api.genai.Client") as mock_client_class:
-        mock_client = mock_client_class.return_value
+    # Mock the engine's SDK client and its models.list() method
+    with patch.object(api.engine, "client") as mock_client:
         mock_client.models.list.return_value = []
 
         response = client.get("/health")
@@ -32,6 +48,349 @@ def test_health_endpoint_returns_200(client, test_env_vars):
         assert data["model"] == "gemini-3-pro-image-preview"
 
 
+@pytest.fixture
+def test_settings(test_env_vars, tmp_path, monkeypatch):
+    """Enable the test endpoint with temp dirs isolated per test."""
+    monkeypatch.setenv("ENABLE_TEST_ENDPOINT", "true")
+    settings = Settings(
+        temp_upload_dir=tmp_path / "uploads", output_dir=tmp_path / "output"
+    )
+    settings.temp_upload_dir.mkdir()
+    app.dependency_overrides[get_settings] = lambda: settings
+    yield settings
+    app.dependency_overrides.clear()
+
+
+def test_oauth_callback_escapes_code(client):
+    """Test the callback page shows the code HTML-escaped."""
+    response = client.get(
+        "/oauth/callback", params={"code": "4/0Ab<script>alert(1)</script>"}
+    )
+
+    assert response.status_code == 200
+    assert "4/0Ab&lt;script&gt;alert(1)&lt;/script&gt;" in response.text
+    assert "<script>alert(1)" not in response.text
+
+
+@pytest.fixture
+def oauth_cache():
+    """Start each test with an empty OAuth verification cache."""
+    api._oauth_cache.clear()
+    yield api._oauth_cache
+    api._oauth_cache.clear()
+
+
+def test_verify_oauth_token_caches_valid_token(oauth_cache):
+    """Test a verified token is served from cache on subsequent requests."""
+    userinfo = MagicMock(status_code=200)
+    userinfo.json.return_value = {"email": "ieie@example.com"}
+
+    with patch.object(
+        api._http, "get", new=AsyncMock(return_value=userinfo)
+    ) as mock_get:
+        first = asyncio.run(verify_oauth_token("Bearer valid-token"))
+        second = asyncio.run(verify_oauth_token("Bearer valid-token"))
+
+    assert first == second == {"email": "ieie@example.com"}
+    mock_get.assert_awaited_once()
+    assert "valid-token" not in oauth_cache
+
+
+def test_oauth_client_survives_repeated_startups(oauth_cache):
+    """Test a restart in the same process gets a fresh, open OAuth HTTP client."""
+    with TestClient(app):
+        pass
+    assert api._http.is_closed
+
+    with TestClient(app):
+        assert not api._http.is_closed
+
+
+def test_verify_oauth_token_does_not_cache_rejection(oauth_cache):
+    """Test an invalid token is re-checked instead of cached."""
+    with patch.object(
+        api._http, "get", new=AsyncMock(return_value=MagicMock(status_code=401))
+    ) as mock_get:
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc_info:
+                asyncio.run(verify_oauth_token("Bearer expired-token"))
+            assert exc_info.value.status_code == 401
+
+    assert mock_get.await_count == 2
+    assert len(oauth_cache) == 0
+
+
+def test_health_endpoint_caches_gemini_probe(client, test_env_vars):
+    """Test repeated health checks reuse the cached Gemini probe."""
+    with patch.object(api.engine, "client") as mock_client:
+        mock_client.models.list.return_value = []
+
+        first = client.get("/health")
+        second = client.get("/health")
+
+    assert first.json()["status"] == second.json()["status"] == "healthy"
+    mock_client.models.list.assert_called_once()
+
+
+def test_health_endpoint_reports_degraded_gemini(client, test_env_vars):
+    """Test a failing Gemini probe marks the service as degraded."""
+    with patch.object(api.engine, "client") as mock_client:
+        mock_client.models.list.side_effect = RuntimeError("down")
+
+        response = client.get("/health")
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "degraded"
+
+
+@pytest.mark.parametrize(
+    "filename, expected",
+    [
+        ("47_pantalon_20251229-195429.HEIC", ("47", "pantalon")),
+        ("42_saia_20251229.HEIC", ("42", "saia")),
+        ("100_vestidofesta_front_20251229.HEIC", ("100", "vestidofesta")),
+        ("21_Saia_20251229.jpg", ("21", "saia")),
+        ("7_Écharpe.jpg", ("7", "écharpe")),
+        ("9_calção_20251229.HEIC", ("9", "calção")),
+        ("10_acessório.png", ("10", "acessório")),
+        ("8_écharpe.jpg", ("8", "écharpe")),
+        ("12_front_20251229.HEIC", ("12", None)),
+        ("33_back_20251229.HEIC", ("33", None)),
+        ("55_calca2_20251229.HEIC", ("55", None)),
+        ("100.png", ("100", None)),
+        ("photo_20251229.HEIC", (None, None)),
+    ],
+)
+def test_extract_metadata_from_filename(filename, expected):
+    """Test garment number/type extraction from upload filenames."""
+    assert _extract_metadata_from_filename(filename) == expected
+
+
+def test_generate_test_endpoint_returns_generated_image(
+    client, test_settings, sample_image, sample_image_bytes, tmp_path
+):
+    """Test uploads are preprocessed in memory and passed to the engine."""
+    result_path = tmp_path / "cabide_42_saia_job.png"
+    sample_image.save(result_path)
+    expected = result_path.read_bytes()
+
+    with patch.object(
+        api.engine, "generate_lifestyle_photo", return_value=str(result_path)
+    ) as mock_generate:
+        response = client.post(
+            "/generate/test",
+            files=[
+                ("files", ("42_saia_20251229.png", sample_image_bytes, "image/png"))
+            ],
+            data={"env": "beach"},
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["cache-control"] == "no-store"
+    assert response.content == expected
+    assert result_path.exists()  # outputs are kept by default
+
+    (garment_buffer,) = mock_generate.call_args.args[0]
+    with Image.open(garment_buffer) as garment:
+        assert garment.format == "JPEG"
+    assert mock_generate.call_args.kwargs["garment_number"] == "42"
+    assert mock_generate.call_args.kwargs["garment_type"] == "saia"
+    assert mock_generate.call_args.kwargs["job_id"]
+    assert list(test_settings.temp_upload_dir.iterdir()) == []
+
+
+def test_generate_test_endpoint_removes_output_when_not_kept(
+    client, test_settings, sample_image, sample_image_bytes, tmp_path
+):
+    """Test KEEP_GENERATED_IMAGES=false deletes the output once it is sent."""
+    test_settings.keep_generated_images = False
+    result_path = tmp_path / "cabide_42_saia_job.png"
+    sample_image.save(result_path)
+
+    with patch.object(
+        api.engine, "generate_lifestyle_photo", return_value=str(result_path)
+    ):
+        response = client.post(
+            "/generate/test",
+            files=[("files", ("42_saia.png", sample_image_bytes, "image/png"))],
+        )
+
+    assert response.status_code == 200
+    assert response.content
+    assert not result_path.exists()
+
+
+def test_generate_test_endpoint_single_upload_through_real_engine(
+    client, test_settings, sample_image, sample_image_bytes, monkeypatch
+):
+    """Test a single upload reaches Gemini through the real engine."""
+    monkeypatch.setattr(api.engine.settings, "output_dir", test_settings.output_dir)
+    test_settings.output_dir.mkdir()
+    generated = BytesIO()
+    sample_image.save(generated, format="PNG")
+    part = MagicMock()
+    part.inline_data.data = generated.getvalue()
+
+    with patch.object(api.engine, "client") as mock_client:
+        mock_client.models.generate_content.return_value.candidates = [
+            MagicMock(content=MagicMock(parts=[part]))
+        ]
+        response = client.post(
+            "/generate/test",
+            files=[
+                ("files", ("42_saia_20251229.png", sample_image_bytes, "image/png"))
+            ],
+            data={"env": "beach"},
+        )
+
+    assert response.status_code == 200
+    with Image.open(BytesIO(response.content)) as result:
+        assert result.size == sample_image.size
+    contents = mock_client.models.generate_content.call_args.kwargs["contents"]
+    assert len(contents) == 2  # prompt + the single garment photo
+    assert len(list(test_settings.output_dir.iterdir())) == 1  # kept by default
+
+
+def test_generate_test_endpoint_jobs_do_not_share_output(
+    client, test_settings, sample_image, sample_image_bytes, monkeypatch
+):
+    """Test two jobs for the same garment write separate output files."""
+    monkeypatch.setattr(api.engine.settings, "output_dir", test_settings.output_dir)
+    test_settings.output_dir.mkdir()
+    generated = BytesIO()
+    sample_image.save(generated, format="PNG")
+    part = MagicMock()
+    part.inline_data.data = generated.getvalue()
+
+    with (
+        patch.object(api.engine, "client") as mock_client,
+        patch.object(
+            api.engine, "_save_image", wraps=api.engine._save_image
+        ) as mock_save,
+    ):
+        mock_client.models.generate_content.return_value.candidates = [
+            MagicMock(content=MagicMock(parts=[part]))
+        ]
+        for _ in range(2):
+            response = client.post(
+                "/generate/test",
+                files=[("files", ("42_saia.png", sample_image_bytes, "image/png"))],
+            )
+            assert response.status_code == 200
+
+    saved = [call.args[1] for call in mock_save.call_args_list]
+    assert len(set(saved)) == 2
+    assert all(name.startswith("cabide_42_saia_") for name in saved)
+
+
+def test_generate_test_endpoint_rejects_invalid_image(
+    client, test_settings, sample_image_bytes
+):
+    """Test unsupported or corrupt uploads are rejected before generation."""
+    with patch.object(api.engine, "generate_lifestyle_photo") as mock_generate:
+        bad_type = client.post(
+            "/generate/test",
+            files=[("files", ("42_saia.txt", b"not an image", "text/plain"))],
+        )
+        corrupt = client.post(
+            "/generate/test",
+            files=[("files", ("42_saia.png", b"not an image", "image/png"))],
+        )
+
+    assert bad_type.status_code == 400
+    assert "Unsupported file type" in bad_type.json()["detail"]
+    assert corrupt.status_code == 400
+    assert "Failed to process image" in corrupt.json()["detail"]
+    mock_generate.assert_not_called()
+    assert list(test_settings.temp_upload_dir.iterdir()) == []
+
+
+def test_generate_test_endpoint_rejects_truncated_jpeg(
+    client, test_settings, sample_image
+):
+    """Test a truncated small JPEG is rejected instead of copied through."""
+    jpeg = BytesIO()
+    sample_image.save(jpeg, format="JPEG")
+    truncated = jpeg.getvalue()[:-50]  # header intact, scan data cut short
+
+    with patch.object(api.engine, "generate_lifestyle_photo") as mock_generate:
+        response = client.post(
+            "/generate/test",
+            files=[("files", ("42_saia.jpg", truncated, "image/jpeg"))],
+        )
+
+    assert response.status_code == 400
+    assert "Failed to process image" in response.json()["detail"]
+    mock_generate.assert_not_called()
+
+
+def test_generate_test_endpoint_rejects_oversized_upload(
+    client, test_settings, sample_image_bytes
+):
+    """Test uploads above max_upload_bytes are rejected with 413."""
+    test_settings.max_upload_bytes = len(sample_image_bytes) - 1
+
+    with patch.object(api.engine, "generate_lifestyle_photo") as mock_generate:
+        response = client.post(
+            "/generate/test",
+            files=[("files", ("42_saia.png", sample_image_bytes, "image/png"))],
+        )
+
+    assert response.status_code == 413
+    assert "too large" in response.json()["detail"]
+    mock_generate.assert_not_called()
+
+
+def test_generate_test_endpoint_rejects_oversized_request_before_parsing(
+    test_settings, sample_image_bytes
+):
+    """Test bodies above the size limit get 413 from the declared length."""
+    client = TestClient(
+        _RequestSizeLimitMiddleware(app, max_bytes=len(sample_image_bytes) // 2)
+    )
+
+    with patch.object(api.engine, "generate_lifestyle_photo") as mock_generate:
+        response = client.post(
+            "/generate/test",
+            files=[("files", ("42_saia.png", sample_image_bytes, "image/png"))],
+        )
+
+    assert response.status_code == 413
+    assert "Request too large" in response.json()["detail"]
+    mock_generate.assert_not_called()
+
+
+def test_generate_test_endpoint_rejects_oversized_chunked_request(
+    test_settings, sample_image_bytes
+):
+    """Test chunked bodies without Content-Length are cut off at the limit."""
+    client = TestClient(
+        _RequestSizeLimitMiddleware(app, max_bytes=len(sample_image_bytes) // 2)
+    )
+    boundary = "cabide"
+    body = (
+        (
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="files"; filename="42_saia.png"\r\n'
+            "Content-Type: image/png\r\n\r\n"
+        ).encode()
+        + sample_image_bytes
+        + f"\r\n--{boundary}--\r\n".encode()
+    )
+
+    with patch.object(api.engine, "generate_lifestyle_photo") as mock_generate:
+        response = client.post(
+            "/generate/test",
+            content=iter([body]),
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        )
+
+    assert response.status_code == 413
+    assert "Request too large" in response.json()["detail"]
+    mock_generate.assert_not_called()
+
+
 @pytest.mark.skip(reason="OAuth authentication blocks endpoint - needs mock refactor")
 def test_generate_endpoint_rejects_invalid_file_type(client, test_env_vars):
     """Test generate endpoint rejects invalid file types."""
@@ -0,0 +1,56 @@
+"""
+Tests for the Streamlit frontend.
+"""
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+from src.config import get_settings
+from src.engine import FashionEngine
+
+
+@pytest.fixture
+def app_test(test_env_vars, monkeypatch):
+    """Run src/app.py logged in and in direct engine mode."""
+    monkeypatch.delenv("BACKEND_URL", raising=False)
+    get_settings.cache_clear()
+    with (
+        patch("src.auth_ui.require_authentication", lambda helper: None),
+        patch("src.oauth_helper.UnifiedOAuthHelper", MagicMock()),
+    ):
+        yield AppTest.from_file("../src/app.py", default_timeout=30)
+    get_settings.cache_clear()
+
+
+def test_model_attribute_from_lazy_expander_reaches_engine(
+    app_test, sample_image_bytes, sample_image_file
+):
+    """Test a model attribute picked in the opened expander is used on submit."""
+    app_test.run()
+    assert "model_height" not in [w.key for w in app_test.selectbox]
+
+    # Opening the expander reruns with its body rendered
+    app_test.session_state["model_attrs_expander"] = True
+    app_test.run()
+    app_test.selectbox[0].set_value("Saia")
+    app_test.selectbox(key="model_height").set_value("Alta")
+    app_test.text_input[0].set_value("42")
+    app_test.file_uploader[0].set_value(
+        ("42_saia.png", sample_image_bytes, "image/png")
+    )
+
+    with patch.object(
+        FashionEngine,
+        "generate_lifestyle_photo",
+        return_value=str(sample_image_file),
+    ) as mock_generate:
+        app_test.session_state["model_attrs_expander"] = True  # still open
+        app_test.button[0].click().run()
+
+    assert not app_test.exception
+    mock_generate.assert_called_once()
+    assert mock_generate.call_args.kwargs["model_attributes"] == {"height": "Alta"}
+    assert mock_generate.call_args.kwargs["garment_number"] == "42"
+    assert mock_generate.call_args.kwargs["garment_type"] == "Saia"
@@ -35,3 +35,18 @@ def test_settings_from_env(test_env_vars, monkeypatch):
     monkeypatch.setenv("GDRIVE_FOLDER_ID", "custom-folder-id-123")
     settings = Settings()
     assert settings.gdrive_folder_id == "custom-folder-id-123"
+
+
+def test_settings_validation_resample_filter(test_env_vars):
+    """Test only supported resampling filters are accepted."""
+    assert Settings().resample_filter == "bicubic"
+    assert Settings(resample_filter="lanczos").resample_filter == "lanczos"
+    with pytest.raises(ValueError):
+        Settings(resample_filter="nearest")
+
+
+def test_settings_validation_max_concurrent_generations(test_env_vars, monkeypatch):
+    """Test the generation concurrency limit must allow at least one call."""
+    monkeypatch.setenv("MAX_CONCURRENT_GENERATIONS", "0")
+    with pytest.raises(ValueError):
+        Settings()
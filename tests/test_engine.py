@@ -0,0 +1,58 @@
+"""
+Tests for the generation engine's image preprocessing.
+"""
+
+from io import BytesIO
+
+from PIL import ExifTags, Image
+
+from src.config import Settings
+from src.engine import preprocess_image
+
+
+def test_preprocess_image_downscales_large_jpeg(test_env_vars):
+    """Test large photos are resized to max_image_dimension as RGB JPEG."""
+    source = BytesIO()
+    Image.new("RGB", (4032, 3024), color="blue").save(source, format="JPEG")
+    source.seek(0)
+
+    with Image.open(preprocess_image(source, Settings())) as result:
+        assert result.format == "JPEG"
+        assert result.mode == "RGB"
+        assert result.size == (1536, 1152)
+
+
+def test_preprocess_image_copies_small_rgb_jpeg(test_env_vars):
+    """Test small RGB JPEGs are passed through byte-for-byte."""
+    source = BytesIO()
+    Image.new("RGB", (800, 600), color="blue").save(source, format="JPEG")
+    source.seek(0)
+
+    assert preprocess_image(source, Settings()).getvalue() == source.getvalue()
+
+
+def test_preprocess_image_flattens_large_rgba_png(test_env_vars):
+    """Test oversized transparent PNGs become downscaled RGB JPEGs."""
+    source = BytesIO()
+    Image.new("RGBA", (3000, 2000), color=(0, 0, 255, 128)).save(source, format="PNG")
+    source.seek(0)
+
+    with Image.open(preprocess_image(source, Settings())) as result:
+        assert result.format == "JPEG"
+        assert result.mode == "RGB"
+        assert result.size == (1536, 1024)
+
+
+def test_preprocess_image_strips_exif_and_applies_orientation(test_env_vars):
+    """Test small JPEGs with EXIF are re-encoded upright and without metadata."""
+    exif = Image.Exif()
+    exif[ExifTags.Base.Orientation] = 6  # rotate 90° clockwise when displayed
+    source = BytesIO()
+    Image.new("RGB", (800, 600), color="blue").save(
+        source, format="JPEG", exif=exif.tobytes()
+    )
+    source.seek(0)
+
+    with Image.open(preprocess_image(source, Settings())) as result:
+        assert result.size == (600, 800)
+        assert "exif" not in result.info